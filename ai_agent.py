@@ -1,7 +1,13 @@
 import pandas as pd
-from typing import Dict, Any, Optional
+import numpy as np
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
 import json
 import time
+import threading
+import ahocorasick
+from sentence_transformers import SentenceTransformer
 from chart_processor import create_chartjs_data
 from dataModels.chartModels import ChartDataOutput, ChartOptions, ChartOptionsScales, ChartOptionsScalesAxis, ChartOptionsScalesAxisTitle
 from custom_llama_cpp import CustomLlamaCLI # Assuming this is your custom LLM wrapper
@@ -11,15 +17,96 @@ HOURS_IN_YEAR = 365 * 24
 HOURLY_COMPUTE_COST = YEARLY_COMPUTE_COST_IN_CENTS / HOURS_IN_YEAR
 SECOND_COMPUTE_COST = HOURLY_COMPUTE_COST / 3600
 
+# The prompt is PROMPT_PREFIX + first data row + PROMPT_USER + user prompt + PROMPT_SUFFIX
+PROMPT_PREFIX = """You are an expert data analyst.
+            Data with column names: """
+PROMPT_USER = """
+            User prompt: """
+PROMPT_SUFFIX = """.
+            Question: What chart type (bar, line or pie) would you use for Data and what column namesUser prompt?
+            Answear: """
+
+class SemanticCache:
+    """
+    Bounded LRU cache of raw LLM responses. A prompt hits the cache when an earlier
+    prompt asked about the same data (column names and first row, which is all the
+    LLM sees of it) has a cosine similarity above the threshold.
+    The embeddings of each data schema are kept stacked in one matrix, so a lookup is a single product.
+    """
+    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+                 similarity_threshold: float = 0.92, max_entries: int = 1024):
+        self.encoder = SentenceTransformer(model_name)
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        # (columns, head_repr) -> embedding matrix and the prompt of each of its rows
+        self.matrices: Dict[Tuple[Tuple[str, ...], str], np.ndarray] = {}
+        self.prompts: Dict[Tuple[Tuple[str, ...], str], List[str]] = {}
+        self.entries: "OrderedDict[Tuple[Tuple[Tuple[str, ...], str], str], str]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def lookup(self, columns: Tuple[str, ...], head_repr: str, prompt: str) -> Tuple[Optional[str], np.ndarray]:
+        """
+        Returns the cached response (or None) together with the prompt embedding,
+        so it can be reused by insert() on a miss.
+        """
+        schema = (columns, head_repr)
+        embedding = self.encoder.encode(SemanticCache.normalize_prompt(prompt), normalize_embeddings=True).astype(np.float32)
+        with self.lock:
+            cache_matrix = self.matrices.get(schema)
+            if cache_matrix is None:
+                return None, embedding
+
+            similarities = cache_matrix @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                return None, embedding
+
+            key = (schema, self.prompts[schema][best])
+            self.entries.move_to_end(key)
+            return self.entries[key], embedding
+
+    def insert(self, columns: Tuple[str, ...], head_repr: str, prompt: str, embedding: np.ndarray, response: str):
+        schema = (columns, head_repr)
+        key = (schema, SemanticCache.normalize_prompt(prompt))
+        with self.lock:
+            if key not in self.entries:
+                cache_matrix = self.matrices.get(schema)
+                self.matrices[schema] = embedding[np.newaxis] if cache_matrix is None else np.vstack((cache_matrix, embedding))
+                self.prompts.setdefault(schema, []).append(key[1])
+            self.entries[key] = response
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_entries:
+                (evicted_schema, evicted_prompt), _ = self.entries.popitem(last=False)
+                self._remove_row(evicted_schema, evicted_prompt)
+
+    def _remove_row(self, schema: Tuple[Tuple[str, ...], str], prompt: str):
+        prompts = self.prompts[schema]
+        if len(prompts) == 1:
+            del self.matrices[schema]
+            del self.prompts[schema]
+            return
+        row = prompts.index(prompt)
+        self.matrices[schema] = np.delete(self.matrices[schema], row, axis=0)
+        del prompts[row]
+
+    @staticmethod
+    def normalize_prompt(prompt: str) -> str:
+        return " ".join(prompt.lower().split())
+
 class DataPlottingAgent:
     def __init__(self):
         self.llm = CustomLlamaCLI(
             n_predict=64,      # Increased prediction length for code generation
             threads=24,           # Number of threads for llama.cpp
             ctx_size=256,       # Increased context window size for more complex prompts/data
-            temperature=0.5,     # Lower temperature for more deterministic code generation
-            conversation=False
+            temperature=0.5     # Lower temperature for more deterministic code generation
         )
+        self.semantic_cache = SemanticCache()
+
+        # The fixed parts of the prompt are tokenized once
+        self.prompt_prefix_ids = self.llm.tokenize(PROMPT_PREFIX, add_bos=True)
+        self.prompt_user_ids = self.llm.tokenize(PROMPT_USER)
+        self.prompt_suffix_ids = self.llm.tokenize(PROMPT_SUFFIX)
 
     def _format_chart_data(self, df: pd.DataFrame, chart_type: str, labels_key: str, values_key: str) -> ChartDataOutput:
         """
@@ -49,38 +136,47 @@ class DataPlottingAgent:
             options=chart_options
         )
 
-    def process_data_and_plot(self, df: pd.DataFrame, user_prompt: str) -> Dict[str, Any]:
+    def process_data_and_plot(self, df: pd.DataFrame, user_prompt: str, head_repr: Optional[str] = None,
+                              columns: Optional[Tuple[str, ...]] = None) -> Dict[str, Any]:
         """
         Processes the DataFrame and user prompt by generating and executing
         pandas code, then formatting the result for charting and summary.
+        head_repr is the rendered first row of df and columns the tuple of its column names,
+        both are computed here if not given.
         """
 
         try:
-            prompt_instructions = f"""You are an expert data analyst.
-            Data with column names: {df.head(1)}
-            User prompt: {user_prompt}.
-            Question: What chart type (bar, line or pie) would you use for Data and what column namesUser prompt?
-            Answear: """
+            if columns is None:
+                columns = tuple(df.columns)
+            if head_repr is None:
+                head_repr = repr(df.head(1))
+            llm_response_raw, prompt_embedding = self.semantic_cache.lookup(columns, head_repr, user_prompt)
+            if llm_response_raw is None:
+                # Only the data row and the user prompt are tokenized per request, the prefix
+                # only depends on the uploaded data, so its KV state is cached by the LLM
+                prefix_ids = self.prompt_prefix_ids + self.llm.tokenize(head_repr) + self.prompt_user_ids
+                prompt_ids = prefix_ids + self.llm.tokenize(user_prompt) + self.prompt_suffix_ids
+
+                start_time = time.time()
+                llm_response_raw = self.llm.generate_from_tokens(prompt_ids, len(prefix_ids))
+                end_time = time.time()
+                duration = end_time - start_time
+                llm_cost = SECOND_COMPUTE_COST * duration
+                self.semantic_cache.insert(columns, head_repr, user_prompt, prompt_embedding, llm_response_raw)
+            else:
+                print("Semantic cache hit, skipping LLM call.")
+                llm_cost = 0
 
-            start_time = time.time()
-            llm_response_raw = self.llm.invoke(prompt_instructions)
-            end_time = time.time()
-            duration = end_time - start_time
-            llm_cost = SECOND_COMPUTE_COST * duration
-            found_chart_types = { "bar" : -1, "line" : -1, "pie" : -1 }
-            found_column_names = {col_name: -1 for col_name in df.columns.values}
-            DataPlottingAgent.find_substrings_in_response(llm_response_raw, found_chart_types)
-            DataPlottingAgent.find_substrings_in_response(llm_response_raw, found_column_names)
-            filtered_chart_types = {k: v for k, v in found_chart_types.items() if v != -1}
-            filtered_column_names = {k: v for k, v in found_column_names.items() if v != -1}
-            sorted_chart_types = dict(sorted(filtered_chart_types.items(), key=lambda item: item[1]))
-            sorted_column_names = dict(sorted(filtered_column_names.items(), key=lambda item: item[1]))
-            choosen_chart_type = next(iter(sorted_chart_types))
+            chart_types = ("bar", "line", "pie")
+            keys, offsets = DataPlottingAgent.find_substrings_in_response(llm_response_raw, chart_types + columns)
+            sorted_chart_types = DataPlottingAgent.sort_found_keys(keys[:len(chart_types)], offsets[:len(chart_types)])
+            sorted_column_names = DataPlottingAgent.sort_found_keys(keys[len(chart_types):], offsets[len(chart_types):])
+            choosen_chart_type = sorted_chart_types[0]
 
             print(f"LLM Cost: ${llm_cost / 100} dollars")
             print(f"Raw LLM Response: {llm_response_raw}") # For debugging
 
-            chart_data = create_chartjs_data(df, list(sorted_column_names.keys()), choosen_chart_type)
+            chart_data = create_chartjs_data(df, sorted_column_names, choosen_chart_type)
         
             return {
                 "chart_data": chart_data,
@@ -97,9 +193,42 @@ class DataPlottingAgent:
             }
 
     @staticmethod
-    def find_substrings_in_response(response_str: str, stringsToFind: dict) -> int:
-        for key, _ in stringsToFind.items():
-            stringsToFind[key] = response_str.find(key)
+    def find_substrings_in_response(response_str: str, stringsToFind: Tuple[str, ...]) -> Tuple[Tuple[str, ...], np.ndarray]:
+        """
+        Scans the response once for all strings at the same time and returns the strings
+        with an array of the offsets of their first occurrence, or -1 if it's not found.
+        """
+        offsets = np.full(len(stringsToFind), -1, dtype=np.int64)
+        automaton = DataPlottingAgent.build_automaton(stringsToFind)
+        for end_index, (length, indices) in automaton.iter(response_str):
+            for index in indices:
+                if offsets[index] == -1:
+                    offsets[index] = end_index - length + 1
+        return stringsToFind, offsets
+
+    @staticmethod
+    def sort_found_keys(keys: Tuple[str, ...], offsets: np.ndarray) -> List[str]:
+        """
+        Returns the found keys ordered by where they first appear in the response.
+        """
+        found = np.nonzero(offsets >= 0)[0]
+        order = np.argsort(offsets[found], kind="stable")
+        return [keys[i] for i in found[order]]
+
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def build_automaton(stringsToFind: Tuple[str, ...]) -> ahocorasick.Automaton:
+        # A string may be both a chart type and a column name, so every word maps to all of its indices
+        indices: Dict[str, List[int]] = {}
+        for index, key in enumerate(stringsToFind):
+            if key:
+                indices.setdefault(key, []).append(index)
+
+        automaton = ahocorasick.Automaton()
+        for key, key_indices in indices.items():
+            automaton.add_word(key, (len(key), tuple(key_indices)))
+        automaton.make_automaton()
+        return automaton
 
     @staticmethod
     def shorten_response(s: str):
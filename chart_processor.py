@@ -1,4 +1,6 @@
 import pandas as pd
+import numpy as np
+import numexpr
 import json
 
 def create_chartjs_data(df: pd.DataFrame, column_names: list, chart_type: str) -> dict:
@@ -31,10 +33,6 @@ def create_chartjs_data(df: pd.DataFrame, column_names: list, chart_type: str) -
         }
     }
 
-    convert_to_numeric(df)
-    for col in column_names:
-        df = remove_outliers_iqr(df, col)
-
     if not column_names:
         raise ValueError("column_names cannot be empty.")
 
@@ -43,23 +41,26 @@ def create_chartjs_data(df: pd.DataFrame, column_names: list, chart_type: str) -
     if missing_columns:
         raise ValueError(f"Columns not found in DataFrame: {', '.join(missing_columns)}")
 
+    # Work on a copy of the chart columns only, the caller's DataFrame may be shared between requests
+    df = df[column_names].copy()
+    convert_to_numeric(df)
+    # The value columns are only averaged and drawn, so float32 is enough for them and halves the
+    # memory scanned by the outlier filter and the aggregation. The label column is the groupby key
+    # and keeps full precision, close labels would otherwise merge into one group
+    for col in column_names[1:]:
+        if df[col].dtype == np.float64:
+            df[col] = df[col].astype(np.float32)
+    df = remove_outliers_iqr(df, column_names)
+
     if chart_type.lower() in ["pie", "doughnut"]:
         if len(column_names) != 2:
             raise ValueError(f"For '{chart_type}' charts, 'column_names' must contain exactly two columns: [labels_column, values_column].")
         
         labels_col = column_names[0]
-        values_col = column_names[1]
+        value_col = column_names[1]
 
         chart_data["labelsKey"] = labels_col
-        chart_data["valuesKey"] = values_col
-
-        # Create data array for pie/doughnut charts
-        for index, row in df[[labels_col, values_col]].iterrows():
-            chart_data["data"].append({
-                f"{labels_col}": int(row[labels_col]) if pd.api.types.is_integer_dtype(df[labels_col]) else float(row[labels_col]),
-                f"{values_col}": int(row[values_col]) if pd.api.types.is_integer_dtype(df[values_col]) else float(row[values_col])
-            })
-        
+
         # Pie/Doughnut charts don't typically have x and y scales in the same way bar/line charts do
         chart_data["options"].pop("scales", None)
 
@@ -67,83 +68,65 @@ def create_chartjs_data(df: pd.DataFrame, column_names: list, chart_type: str) -
         labels_col = column_names[0]
         chart_data["labelsKey"] = labels_col
         
-        # Populate labels for the 'data' structure
-        chart_data["data"] = [{f"{labels_col}": int(val)} for val in df[labels_col].tolist()]
-
         # For multiple value columns, we need to restructure the 'data' and 'valuesKey'
         # The provided Chart.js format seems to imply a single 'value' field per data point.
         # For multi-series charts, Chart.js typically uses a 'datasets' array.
         # This implementation will focus on the provided single 'data' array structure
-        # for simplicity, assuming the first column is labels and subsequent are values,
-        # aggregating them into a single 'value' if multiple numeric columns are provided.
+        # for simplicity, assuming the first column is labels and the value is either the
+        # only remaining column or the first *numeric* column after the label column.
         # If you need multi-series, the 'data' and 'options' structure would need to be more complex.
-
-        if len(column_names) > 1:
-            value_columns = column_names[1:]
-            
-            # If there's only one value column, just add it directly
-            if len(value_columns) == 1:
-                chart_data["valuesKey"] = value_columns[0]
-                for i, val in enumerate(df[value_columns[0]].tolist()):
-                    chart_data["data"][i][f"{value_columns[0]}"] = int(val) if pd.api.types.is_integer_dtype(df[value_columns[0]]) else float(val)
-            else:
-                # If multiple value columns, this structure needs a more complex 'data' array
-                # or a 'datasets' array. For the given output format, we'll sum them up
-                # or you'll need to clarify how multiple value columns should be represented.
-                # For now, let's assume we're adding them as separate properties within the 'name' object
-                # or picking the first one. Let's adapt to the provided format:
-                # {{"name": "string", "value": int}} -- this implies a single value.
-                # So for multiple columns, we will need to decide which one is the "value".
-                # For this example, let's assume the first *numeric* column after the label column is the 'value'.
-                
-                found_value_col = False
-                for col in value_columns:
-                    if pd.api.types.is_numeric_dtype(df[col]):
-                        chart_data["valuesKey"] = col
-                        for i, val in enumerate(df[col].tolist()):
-                            chart_data["data"][i][f"{col}"] = int(val) if pd.api.types.is_integer_dtype(df[col]) else float(val)
-                        found_value_col = True
-                        break
-                if not found_value_col:
-                     raise ValueError("No numeric column found to represent 'value' in the selected columns.")
-
-    chart_data["options"]["scales"]["x"]["title"]["text"] = labels_col
-    
-    chart_data["data"] = sorted(chart_data["data"], key= lambda item: list(item.values())[0])
-    df_grouped = pd.DataFrame(chart_data["data"])
-    numerical_cols = df_grouped.select_dtypes(include=['number']).columns.tolist()
-
-    aggregate_by_col = column_names[0]
-
-    if aggregate_by_col in numerical_cols:
-        numerical_cols.remove(aggregate_by_col)
-
-    #aggregation_functions = ['mean', 'max', 'min']
-    aggregation_functions = ['mean']
-
-    agg_dict = {col: aggregation_functions for col in numerical_cols}
-    grouped_df = df_grouped.groupby(aggregate_by_col).agg(agg_dict)
-    grouped_df.columns = [multiindex[0] for multiindex in grouped_df.columns.values]
-    chart_data["data"] = grouped_df.reset_index().to_dict(orient='records')
+        value_col = None
+        value_columns = column_names[1:]
+        if len(value_columns) == 1:
+            value_col = value_columns[0]
+        elif len(value_columns) > 1:
+            value_col = next((col for col in value_columns if pd.api.types.is_numeric_dtype(df[col])), None)
+            if value_col is None:
+                raise ValueError("No numeric column found to represent 'value' in the selected columns.")
+
+        chart_data["options"]["scales"]["x"]["title"]["text"] = labels_col
+
+    # Sort by label and average the values of repeated labels directly on the DataFrame,
+    # only the aggregated rows are turned into dicts
+    if value_col is None:
+        grouped_df = df[[labels_col]].drop_duplicates().sort_values(labels_col)
+    else:
+        chart_data["valuesKey"] = value_col
+        grouped_df = df.groupby(labels_col, as_index=False)[value_col].mean()
+    # A float32 value column is widened through its shortest representation,
+    # a direct cast would send 1.1 as 1.100000023841858
+    if value_col is not None and grouped_df[value_col].dtype == np.float32:
+        grouped_df[value_col] = grouped_df[value_col].to_numpy().astype(str).astype(np.float64)
+    chart_data["data"] = grouped_df.to_dict(orient='records')
     return chart_data
 
 
 def convert_to_numeric(df: pd.DataFrame):
     for col in df.columns:
+        if pd.api.types.is_numeric_dtype(df[col]):
+            # numexpr only works on NumPy arrays, so Arrow-backed numeric columns are moved to NumPy dtypes
+            if not isinstance(df[col].dtype, np.dtype):
+                s = df[col]
+                if pd.api.types.is_integer_dtype(s) and not s.isna().any():
+                    df[col] = s.to_numpy(dtype=np.int64)
+                else:
+                    df[col] = s.to_numpy(dtype=np.float64, na_value=np.nan)
+            continue
         try:
             # Attempt to convert to numeric, coercing errors to NaN
             s = pd.to_numeric(df[col], errors='coerce')
+            values = s.to_numpy(dtype=np.float64, na_value=np.nan)
 
             # Check if there are any NaN values after conversion
-            if s.isnull().any():
+            if np.isnan(values).any():
                 print(f"Column '{col}' contains non-numeric values and cannot be fully converted to int without loss.")
                 # Option 1: Keep the original column or handle the NaNs differently
                 # df[col] = s # If you want to keep the NaN values
             else:
                 # Check if all values are effectively integers (e.g., '8.0' can be int)
                 # This ensures we don't convert floats like 9.1 to 9
-                if all(x == int(x) for x in s if pd.notnull(x)): # Only check non-nulls
-                    df[col] = s.astype(int)
+                if np.all(values == np.trunc(values)):
+                    df[col] = s.astype(np.int64)
                     print(f"Column '{col}' successfully converted to int.")
                 else:
                     print(f"Column '{col}' contains float values that would lose precision if converted to int. Keeping as is.")
@@ -151,25 +134,51 @@ def convert_to_numeric(df: pd.DataFrame):
         except Exception as e:
             print(f"An unexpected error occurred while processing column '{col}': {e}")
 
-def remove_outliers_iqr(dataframe, column_name):
+    # Integers are downcast to the smallest type that holds their values, which loses nothing
+    for col in df.select_dtypes(include='int64').columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+
+def remove_outliers_iqr(dataframe, column_names):
     """
-    Removes outliers from a specified column in a DataFrame using the IQR method.
+    Removes outliers from the specified columns in a DataFrame using the IQR method.
+    The quantiles of all columns are computed at once and a row is kept only if
+    every numeric column is within its bounds. The bounds of all columns are checked
+    in a single numexpr expression, so the DataFrame is scanned and filtered once.
 
     Args:
         dataframe (pd.DataFrame): The input DataFrame.
-        column_name (str): The name of the column to remove outliers from.
+        column_names (list): The names of the columns to remove outliers from.
+                             Non-numeric columns are ignored.
 
     Returns:
-        pd.DataFrame: A new DataFrame with outliers removed from the specified column.
+        pd.DataFrame: A new DataFrame with outliers removed from the specified columns.
     """
-    print(f"Removing outliers from column: {column_name}...")
-    Q1 = dataframe[column_name].quantile(0.25)
-    Q3 = dataframe[column_name].quantile(0.75)
+    numeric_columns = [col for col in column_names if pd.api.types.is_numeric_dtype(dataframe[col])]
+    if not numeric_columns:
+        return dataframe
+
+    print(f"Removing outliers from columns: {', '.join(numeric_columns)}...")
+    quantiles = dataframe[numeric_columns].quantile([0.25, 0.75])
+    Q1 = quantiles.loc[0.25]
+    Q3 = quantiles.loc[0.75]
     IQR = Q3 - Q1
     lower_bound = Q1 - 1.5 * IQR
     upper_bound = Q3 + 1.5 * IQR
 
-    # Filter out the rows where the column value is outside the bounds
-    df_cleaned = dataframe[(dataframe[column_name] >= lower_bound) & (dataframe[column_name] <= upper_bound)]
-    print(f"Outliers removed from column: {column_name}. Rows remaining: {len(df_cleaned)}")
-    return df_cleaned
\ No newline at end of file
+    # Filter out the rows where any column value is outside the bounds. The columns are passed
+    # to numexpr as arrays under generated names, so column names never end up in the expression
+    arrays = {}
+    conditions = []
+    for i, col in enumerate(numeric_columns):
+        values = dataframe[col].to_numpy()
+        # numexpr only handles NumPy numbers, missing values become NaN and are treated as outliers
+        if not isinstance(values.dtype, np.dtype) or values.dtype.kind not in "iuf":
+            values = dataframe[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        arrays[f"c{i}"] = values
+        arrays[f"lo{i}"] = np.float64(lower_bound[col])
+        arrays[f"hi{i}"] = np.float64(upper_bound[col])
+        conditions.append(f"(c{i} >= lo{i}) & (c{i} <= hi{i})")
+    mask = numexpr.evaluate(" & ".join(conditions), local_dict=arrays)
+    df_cleaned = dataframe.loc[mask]
+    print(f"Outliers removed from columns: {', '.join(numeric_columns)}. Rows remaining: {len(df_cleaned)}")
+    return df_cleaned
@@ -1,14 +1,15 @@
 import pandas as pd
 import logging
-import time
+from collections import defaultdict
 from typing import List, Dict
 import io
+import pyarrow.csv as pacsv
 
 logger = logging.getLogger(__name__)
 
 def process_csv_data(file_path: str, background_task: bool = False) -> List[Dict]:
     """
-    Processes the CSV file, converts it to a list of dictionaries, and simulates processing time.
+    Processes the CSV file and converts it to a list of dictionaries.
 
     Args:
         file_path (str): The path to the CSV file.
@@ -23,9 +24,6 @@ def process_csv_data(file_path: str, background_task: bool = False) -> List[Dict
         else:
             logger.info(f"Processing CSV file: {file_path}")
 
-        # Simulate file processing delay (remove or adjust as needed)
-        time.sleep(2)
-
         # Read the CSV file using pandas
         df = pd.read_csv(file_path)
 
@@ -58,18 +56,47 @@ def sanitize_for_csv_injection(data: pd.DataFrame) -> pd.DataFrame:
     Sanitizes a Pandas DataFrame to prevent CSV formula injection.
     Prepends a tab character to string cells that start with '=', '+', '-', or '@'.
     """
-    def sanitize_cell(cell):
-        if isinstance(cell, str) and cell.startswith(('=', '+', '-', '@')):
-            return f'\t{cell}'
-        return cell
+    sanitized = data.copy()
+    # Only string columns can hold formulas, numeric columns are left untouched
+    for col in sanitized.columns:
+        s = sanitized[col]
+        if not (pd.api.types.is_object_dtype(s) or pd.api.types.is_string_dtype(s)):
+            continue
+        try:
+            mask = s.str.startswith(('=', '+', '-', '@'), na=False)
+        except AttributeError:
+            # Object column without any strings
+            continue
+        if mask.any():
+            sanitized.loc[mask, col] = '\t' + s[mask]
+    return sanitized
 
-    return data.applymap(sanitize_cell)
+def deduplicate_column_names(columns: List[str]) -> List[str]:
+    """
+    Renames repeated column names with the C parser's suffixes, so 'a', 'a' becomes 'a', 'a.1'.
+    """
+    names = [str(col) for col in columns]
+    counts: Dict[str, int] = defaultdict(int)
+    for i, col in enumerate(names):
+        cur_count = counts[col]
+        while cur_count > 0:
+            counts[col] = cur_count + 1
+            col = f"{col}.{cur_count}"
+            cur_count = counts[col]
+        names[i] = col
+        counts[col] = cur_count + 1
+    return names
 
 def process_csv_with_pandas(file_content: bytes) -> pd.DataFrame:
     """
     Processes the CSV data using Pandas. Add your specific logic here.
     """
-    df = pd.read_csv(io.BytesIO(file_content), dtype=str)  # Read all as strings initially
+    # The multi-threaded PyArrow reader infers column types, numeric columns stay numeric.
+    # It's called directly rather than through pd.read_csv(engine='pyarrow'), which can't convert
+    # duplicated headers of different types, and Parquet can't store duplicated headers either
+    table = pacsv.read_csv(io.BytesIO(file_content))
+    table = table.rename_columns(deduplicate_column_names(table.column_names))
+    df = table.to_pandas(types_mapper=pd.ArrowDtype)
     # Add your data processing logic here, e.g., type conversions, cleaning, etc.
     # Example: Convert 'column_with_numbers' to numeric if expected
     # if 'column_with_numbers' in df.columns:
@@ -1,43 +1,42 @@
-import subprocess
 import os
-import platform
-from typing import Any, List, Mapping, Optional
+import threading
+from collections import OrderedDict
+from typing import Any, List, Mapping, Optional, Tuple
 
 from langchain_core.language_models.llms import LLM
 from langchain_core.callbacks import CallbackManagerForLLMRun
+from llama_cpp import Llama, LlamaState
 
 class CustomLlamaCLI(LLM):
     """
-    Custom LLM class that interfaces with a local llama.cpp CLI executable.
+    Custom LLM class that interfaces with llama.cpp through the llama-cpp-python bindings.
 
-    It automatically locates the llama-cli executable in './libs/'
-    and the .gguf model in './models/' relative to the script's directory.
+    It automatically locates the .gguf model in './models/' relative to the
+    script's directory and keeps it loaded for the lifetime of the instance,
+    so the weights are not re-read from disk on every call.
+
+    Callers may pass a `prefix` keyword argument naming the static leading part
+    of the prompt, or a prefix length to generate_from_tokens(). Its KV state is
+    evaluated once, snapshotted and restored on later calls, so only the remaining
+    tail of the prompt has to be prefilled.
     """
     n_predict: int = 128
     threads: int = 2
     ctx_size: int = 2048
     temperature: float = 0.8
-    conversation: bool = False
+    # Each snapshot holds the full KV cache of the context, so the cache is bounded by size, not entry count
+    prefix_cache_bytes: int = 512 * 1024 * 1024
 
-    _executable_path: Optional[str] = None
     _model_path: Optional[str] = None
+    _llama: Optional[Llama] = None
+    _prefix_states: Optional["OrderedDict[Tuple[int, ...], LlamaState]"] = None
+    _prefix_states_bytes: int = 0
+    _lock: Optional[threading.Lock] = None
 
     def __init__(self, **data: Any):
         super().__init__(**data)
         script_directory = os.path.dirname(os.path.abspath(__file__))
 
-        # Determine executable name based on OS
-        if platform.system() == "Windows":
-            self._executable_path = os.path.join(script_directory, "libs", "llama-cli.exe")
-        else:
-            self._executable_path = os.path.join(script_directory, "libs", "llama-cli")
-
-        if not os.path.exists(self._executable_path):
-            raise FileNotFoundError(
-                f"Error: Llama CLI executable not found at {self._executable_path}. "
-                "Please ensure it's in the './libs/' directory relative to your script."
-            )
-
         # Find the .gguf model file
         models_dir = os.path.join(script_directory, "models")
         if not os.path.exists(models_dir):
@@ -58,7 +57,18 @@ class CustomLlamaCLI(LLM):
                 f"Error: No .gguf model found in {models_dir}. "
                 "Please place at least one .gguf model file in this directory."
             )
-            
+
+        self._llama = Llama(
+            model_path=self._model_path,
+            n_ctx=self.ctx_size,
+            n_threads=self.threads,
+            n_gpu_layers=0,
+            verbose=False,
+        )
+        self._prefix_states = OrderedDict()
+        # The llama.cpp context holds a single KV cache, so calls from worker threads must not interleave
+        self._lock = threading.Lock()
+
     @property
     def _llm_type(self) -> str:
         return "custom_llama_cli"
@@ -71,92 +81,87 @@ class CustomLlamaCLI(LLM):
         **kwargs: Any,
     ) -> str:
         """
-        Runs the llama.cpp CLI with the given prompt and parameters.
+        Runs the resident llama.cpp model on the given prompt.
         """
-        command = [
-            self._executable_path,
-            "-m", self._model_path,
-            "-n", str(self.n_predict),
-            "-t", str(self.threads),
-            "-p", prompt,
-            "-ngl", "0",
-            "-c", str(self.ctx_size),
-            "--temp", str(self.temperature),
-            "-b", "1",
-        ]
-        if self.conversation:
-            command.append("-cnv")
-
-        # Add stop sequences if provided (llama.cpp supports --reverse-prompt)
-        if stop is not None:
-            for s in stop:
-                command.extend(["--reverse-prompt", s])
-
+        prefix = kwargs.get("prefix")
         try:
-            process = subprocess.run(
-                command,
-                capture_output=True,
-                text=True,
-                check=True,
-                encoding='utf-8'
-            )
-            output = process.stdout.strip()
-
-            # Llama.cpp often echoes the prompt. We need to remove it.
-            # This is a common issue with llama.cpp CLI and requires careful handling.
-            # A more robust solution might involve parsing the output line by line.
-            if output.startswith(prompt):
-                output = output[len(prompt):].strip()
-            
-            # Further truncate if any stop sequence was explicitly added
-            if stop is not None:
-                for s in stop:
-                    if s in output:
-                        output = output.split(s)[0].strip()
-                        break
-            
-            if process.stderr:
-                # Optionally log stderr if needed, but don't return it as part of the output
-                if run_manager:
-                    run_manager.on_llm_new_token(f"STDERR from llama-cli: {process.stderr}", verbose=True)
-
-            return output
-        except subprocess.CalledProcessError as e:
-            error_message = (
-                f"Error running llama-cli: {e}\n"
-                f"Command: {' '.join(e.cmd)}\n"
-                f"Return code: {e.returncode}\n"
-                f"Output (stdout): {e.output}\n"
-                f"Standard Error (stderr): {e.stderr}"
-            )
-            if run_manager:
-                run_manager.on_llm_error(e)
-            raise RuntimeError(error_message) from e
-        except FileNotFoundError as e:
-            error_message = (
-                f"Error: Llama CLI executable not found. "
-                f"Please ensure '{self._executable_path}' exists and is executable."
-            )
-            if run_manager:
-                run_manager.on_llm_error(e)
-            raise FileNotFoundError(error_message) from e
+            if prefix and prompt.startswith(prefix):
+                prefix_tokens = self.tokenize(prefix, add_bos=True)
+                prompt_tokens = prefix_tokens + self.tokenize(prompt[len(prefix):])
+                prefix_length = len(prefix_tokens)
+            else:
+                prompt_tokens = self.tokenize(prompt, add_bos=True)
+                prefix_length = 0
+
+            with self._lock:
+                return self._complete(prompt_tokens, prefix_length, stop)
         except Exception as e:
             error_message = f"An unexpected error occurred: {e}"
             if run_manager:
                 run_manager.on_llm_error(e)
             raise RuntimeError(error_message) from e
 
+    def tokenize(self, text: str, add_bos: bool = False) -> Tuple[int, ...]:
+        """
+        Tokenizes the text with the model's vocabulary. Only the first piece of a prompt should add BOS.
+        """
+        return tuple(self._llama.tokenize(text.encode("utf-8"), add_bos=add_bos))
+
+    def generate_from_tokens(self, prompt_tokens: Tuple[int, ...], prefix_length: int = 0) -> str:
+        """
+        Runs an already tokenized prompt, skipping the LangChain invoke path and its tokenization.
+        The first prefix_length tokens are treated as a cacheable prefix.
+        """
+        with self._lock:
+            return self._complete(prompt_tokens, prefix_length)
+
+    def _complete(self, prompt_tokens: Tuple[int, ...], prefix_length: int = 0, stop: Optional[List[str]] = None) -> str:
+        if prefix_length:
+            self._restore_prefix_state(prompt_tokens[:prefix_length])
+
+        completion = self._llama(
+            list(prompt_tokens),
+            max_tokens=self.n_predict,
+            temperature=self.temperature,
+            stop=stop,
+        )
+        return completion["choices"][0]["text"].strip()
+
+    def _restore_prefix_state(self, prefix_tokens: Tuple[int, ...]) -> None:
+        """
+        Loads the KV state of the given prompt prefix into the model,
+        evaluating and snapshotting it first if it's not cached yet.
+        """
+        state = self._prefix_states.get(prefix_tokens)
+        if state is None:
+            self._llama.reset()
+            self._llama.eval(list(prefix_tokens))
+            state = self._llama.save_state()
+            state_bytes = self._state_nbytes(state)
+            if state_bytes > self.prefix_cache_bytes:
+                return
+            self._prefix_states[prefix_tokens] = state
+            self._prefix_states_bytes += state_bytes
+            while self._prefix_states_bytes > self.prefix_cache_bytes:
+                _, evicted_state = self._prefix_states.popitem(last=False)
+                self._prefix_states_bytes -= self._state_nbytes(evicted_state)
+        else:
+            self._prefix_states.move_to_end(prefix_tokens)
+            self._llama.load_state(state)
+
+    @staticmethod
+    def _state_nbytes(state: LlamaState) -> int:
+        return state.llama_state_size + state.scores.nbytes + state.input_ids.nbytes
+
     @property
     def _identifying_params(self) -> Mapping[str, Any]:
         """
         Return the identifying parameters.
         """
         return {
-            "executable_path": self._executable_path,
             "model_path": self._model_path,
             "n_predict": self.n_predict,
             "threads": self.threads,
             "ctx_size": self.ctx_size,
             "temperature": self.temperature,
-            "conversation": self.conversation,
         }
@@ -1,11 +1,17 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Depends, Body
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.concurrency import run_in_threadpool
 from typing import Optional, Dict, Any
 from pydantic import BaseModel
 import logging
 import uvicorn
-from csv_processor import process_csv_with_pandas, sanitize_for_csv_injection
+import asyncio
+from contextlib import asynccontextmanager
+import hashlib
+import os
+import tempfile
+from csv_processor import process_csv_with_pandas, sanitize_for_csv_injection, cleanup_file
 from jose import jwt
 import secrets
 from datetime import datetime, timedelta
@@ -13,7 +19,20 @@ import pandas as pd
 from ai_agent import DataPlottingAgent
 from dataModels.chartModels import AgentResponse, ChartDataOutput
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Runs the token eviction task for the lifetime of the app.
+    """
+    app.state.token_eviction_task = asyncio.create_task(evict_expired_tokens())
+    yield
+    app.state.token_eviction_task.cancel()
+    try:
+        await app.state.token_eviction_task
+    except asyncio.CancelledError:
+        pass
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:5173", # dev
@@ -38,7 +57,13 @@ SECRET_KEY = "your-super-secret-key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5 MB in bytes
-token_store: Dict[str, Dict] = {} # need to change that to secure cache
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB in bytes
+TOKEN_CLEANUP_INTERVAL_SECONDS = 60
+# Uploaded data is stored in a directory only readable by the server's user
+DATA_STORE_DIR = os.path.join(tempfile.gettempdir(), "ai-csv-agent-data")
+os.makedirs(DATA_STORE_DIR, mode=0o700, exist_ok=True)
+os.chmod(DATA_STORE_DIR, 0o700)
+token_store: Dict[str, Dict] = {} # token -> parquet path, rendered first row, column names and upload time, need to change that to secure cache
 
 agent_processor = DataPlottingAgent()
 
@@ -50,10 +75,44 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def get_data_path(token: str) -> str:
+    # JWTs are long and contain dots, so the file is named after a hash of the token
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    return os.path.join(DATA_STORE_DIR, f"{token_hash}.parquet")
+
+def is_expired(entry: Dict) -> bool:
+    return entry["timestamp"] < datetime.utcnow() - timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+
 async def get_data_by_token(token: str):
-    if token in token_store:
-        return token_store[token]["data"]
-    return None
+    entry = token_store.get(token)
+    if entry is None or is_expired(entry):
+        return None
+    data = await run_in_threadpool(pd.read_parquet, entry["path"], dtype_backend="pyarrow")
+    return {**entry, "data": data}
+
+def remove_stale_data_files():
+    """
+    Removes stored data older than the token lifetime, including files
+    left behind by a previous run whose tokens are no longer in token_store.
+    Files of live tokens are given one more cleanup interval, those are removed with their token.
+    """
+    cutoff = datetime.now().timestamp() - ACCESS_TOKEN_EXPIRE_MINUTES * 60 - TOKEN_CLEANUP_INTERVAL_SECONDS
+    with os.scandir(DATA_STORE_DIR) as entries:
+        for file_entry in entries:
+            if file_entry.is_file() and file_entry.stat().st_mtime < cutoff:
+                cleanup_file(file_entry.path)
+
+async def evict_expired_tokens():
+    """
+    Background task removing expired tokens together with their stored data.
+    """
+    while True:
+        for token, entry in list(token_store.items()):
+            if is_expired(entry):
+                del token_store[token]
+                cleanup_file(entry["path"])
+        await run_in_threadpool(remove_stale_data_files)
+        await asyncio.sleep(TOKEN_CLEANUP_INTERVAL_SECONDS)
 
 @app.get("/")
 async def root():
@@ -69,20 +128,32 @@ async def upload_csv(file: UploadFile = File(...)) -> Dict:
         raise HTTPException(status_code=400, detail="Invalid file type. Please upload a CSV file.")
 
     try:
-        # Efficiently check file size without reading the entire content into memory
-        contents = await file.read()
-        file_size = len(contents)
-        if file_size > MAX_FILE_SIZE:
-            raise HTTPException(status_code=400, detail="File size exceeds the limit of 5 MB.")
+        # Read the file in chunks and stop as soon as it exceeds the size limit
+        contents = bytearray()
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            contents.extend(chunk)
+            if len(contents) > MAX_FILE_SIZE:
+                raise HTTPException(status_code=400, detail="File size exceeds the limit of 5 MB.")
 
-        df = process_csv_with_pandas(contents)
+        # Pandas work runs in the threadpool so the event loop keeps serving other requests
+        df = await run_in_threadpool(process_csv_with_pandas, contents)
 
         # Sanitize the DataFrame to prevent CSV injection
-        sanitized_df = sanitize_for_csv_injection(df)
+        sanitized_df = await run_in_threadpool(sanitize_for_csv_injection, df)
 
         # Generate a unique token
         access_token = create_access_token({"sub": secrets.token_urlsafe(16)})
-        token_store[access_token] = {"data": sanitized_df, "timestamp": datetime.utcnow()}
+        # Keep the data on disk as compressed Parquet instead of holding the DataFrame in memory
+        data_path = get_data_path(access_token)
+        await run_in_threadpool(sanitized_df.to_parquet, data_path, compression="zstd")
+        # The first row rendered for the LLM prompt and the column names are fixed per upload, so they're computed once here
+        head_repr = repr(sanitized_df.head(1))
+        token_store[access_token] = {
+            "path": data_path,
+            "head_repr": head_repr,
+            "columns": tuple(sanitized_df.columns),
+            "timestamp": datetime.utcnow(),
+        }
 
         return {"access_token": access_token, "token_type": "bearer"}
 
@@ -96,7 +167,7 @@ async def upload_csv(file: UploadFile = File(...)) -> Dict:
 class ProcessDataRequest(BaseModel):
     prompt: str
 
-@app.post("/send-prompt")
+@app.post("/send-prompt", response_model=AgentResponse)
 async def get_processed_data(
     request: ProcessDataRequest = Body(...),
     credentials: HTTPAuthorizationCredentials = Depends(security),
@@ -107,16 +178,20 @@ async def get_processed_data(
     """
 
     stored_data = await get_data_by_token(credentials.credentials)
-    if stored_data is None or stored_data.empty:
+    if stored_data is None or stored_data["data"].empty:
         raise HTTPException(status_code=404, detail="Token not found or expired")
 
-    result = agent_processor.process_data_and_plot(stored_data, request.prompt)
-
-    return AgentResponse(
-            chart_data=result["chart_data"],
-            summary=result["summary"],
-            error=result["error"]
-        )
+    result = await run_in_threadpool(
+        agent_processor.process_data_and_plot,
+        stored_data["data"],
+        request.prompt,
+        stored_data["head_repr"],
+        stored_data["columns"],
+    )
+
+    # The response_model validates the result and pydantic serializes it, the validation
+    # is the accepted cost of using FastAPI's supported serialization path
+    return result
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file